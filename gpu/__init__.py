@@ -22,5 +22,21 @@
 #
 
 from .error import GpuError, GpuPollTimeout, GpuRpcTimeout, FspRpcError
-from .fsp_emem_rpc import FspEmemRpc
 from .properties import GpuProperties
+
+# Submodules only needed for some commands are imported on first access
+_LAZY_ATTRS = {
+    "FspEmemRpc": ".fsp_emem_rpc",
+}
+
+__all__ = ["GpuError", "GpuPollTimeout", "GpuRpcTimeout", "FspRpcError", "GpuProperties"] + list(_LAZY_ATTRS)
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    import importlib
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
@@ -25,13 +25,13 @@
 
 from __future__ import print_function
 import os
+import atexit
+import functools
 import mmap
 import struct
 from struct import Struct
 import time
 import sys
-import random
-import optparse
 import traceback
 from logging import debug, info, warning, error
 import logging
@@ -56,10 +56,6 @@ is_linux = platform.system() == "Linux"
 
 is_sysfs_available = is_linux
 
-
-if is_linux:
-    import ctypes
-
 # By default use /dev/mem for MMIO, can be changed with --mmio-access-type sysfs
 mmio_access_type = "devmem"
 
@@ -69,7 +65,19 @@ VERSION = "v2024.12.06o"
 
 SYS_DEVICES = "/sys/bus/pci/devices/"
 
+# sysfs vendor and class values of the devices find_gpus_sysfs() picks up
+NVIDIA_VENDOR = 0x10de
+NVSWITCH_CLASS = 0x068000
+NVIDIA_DEVICE_CLASSES = frozenset([0x030000, 0x030200, NVSWITCH_CLASS])
+
+# Parent sysfs paths by device path. A remove/rescan can renumber buses and
+# change the parents, so the sysfs remove and rescan helpers clear it.
+SYSFS_PARENTS = {}
+
 def sysfs_find_parent(device):
+    if device in SYSFS_PARENTS:
+        return SYSFS_PARENTS[device]
+
     # Get a sysfs path with PCIe topology like:
     # /sys/devices/pci0000:00/0000:00:0d.0/0000:05:00.0/0000:06:00.0/0000:07:00.0
     topo_path = os.path.realpath(device)
@@ -78,41 +86,49 @@ def sysfs_find_parent(device):
 
     # No more parents once we reach /sys/devices/pci*
     if os.path.basename(parent).startswith("pci"):
-        return None
+        parent = None
 
+    SYSFS_PARENTS[device] = parent
     return parent
 
+def sysfs_read_hex_attr(path):
+    # sysfs attributes are small, a single read returns the whole value.
+    # int() takes the raw "0x..." bytes directly, trailing newline included.
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return int(os.read(fd, 64), 16)
+    finally:
+        os.close(fd)
+
 def find_gpus_sysfs(bdf_pattern=None):
     gpus = []
     other = []
-    dev_paths = []
-    for device_dir in os.listdir("/sys/bus/pci/devices/"):
-        dev_path = os.path.join("/sys/bus/pci/devices/", device_dir)
-        bdf = device_dir
-        if bdf_pattern:
-            if bdf_pattern not in bdf:
+    devices = []
+    with os.scandir("/sys/bus/pci/devices/") as entries:
+        for entry in entries:
+            bdf = entry.name
+            if bdf_pattern:
+                if bdf_pattern not in bdf:
+                    continue
+            dev_path = entry.path
+            vendor = sysfs_read_hex_attr(os.path.join(dev_path, "vendor"))
+            if vendor != NVIDIA_VENDOR:
                 continue
-        vendor = open(os.path.join(dev_path, "vendor")).readlines()
-        vendor = vendor[0].strip()
-        if vendor != "0x10de":
-            continue
-        cls = open(os.path.join(dev_path, "class")).readlines()
-        cls = cls[0].strip()
-        if cls != "0x030000" and cls != "0x030200" and cls != "0x068000":
-            continue
-        dev_paths.append(dev_path)
+            cls = sysfs_read_hex_attr(os.path.join(dev_path, "class"))
+            if cls not in NVIDIA_DEVICE_CLASSES:
+                continue
+            devices.append((dev_path, cls))
 
-    def devpath_to_id(dev_path):
-        bdf = os.path.basename(dev_path)
-        return int(bdf.replace(":","").replace(".",""), base=16)
+    def device_to_id(device):
+        # BDF is [domain]:BB:DD.F with the domain being 4 or more digits
+        bdf = os.path.basename(device[0])
+        return (int(bdf[:-8], 16), int(bdf[-7:-5], 16), int(bdf[-4:-2], 16), int(bdf[-1], 16))
 
-    dev_paths = sorted(dev_paths, key=devpath_to_id)
-    for dev_path in dev_paths:
+    devices = sorted(devices, key=device_to_id)
+    for dev_path, cls in devices:
         gpu = None
-        cls = open(os.path.join(dev_path, "class")).readlines()
-        cls = cls[0].strip()
         try:
-            if cls == "0x068000":
+            if cls == NVSWITCH_CLASS:
                 dev = NvSwitch(dev_path=dev_path)
             else:
                 dev = Gpu(dev_path=dev_path)
@@ -148,6 +164,11 @@ class PageInfo(object):
 
 
 class FileRaw(object):
+    # Precompiled pack/unpack by access size, same native layout as
+    # data_from_int()/int_from_data()
+    _packers = {size: Struct(fmt).pack for size, fmt in ((1, "=B"), (2, "=H"), (4, "=I"))}
+    _unpackers = {size: Struct(fmt).unpack for size, fmt in ((1, "=B"), (2, "=H"), (4, "=I"))}
+
     def __init__(self, path, offset, size):
         self.fd = os.open(path, os.O_RDWR | os.O_SYNC)
         self.base_offset = offset
@@ -158,8 +179,7 @@ class FileRaw(object):
             os.close(self.fd)
 
     def write(self, offset, data, size):
-        os.lseek(self.fd, offset, os.SEEK_SET)
-        os.write(self.fd, data_from_int(data, size))
+        os.pwrite(self.fd, self._packers[size](data), offset)
 
     def write8(self, offset, data):
         self.write(offset, data, 1)
@@ -171,10 +191,9 @@ class FileRaw(object):
         self.write(offset, data, 4)
 
     def read(self, offset, size):
-        os.lseek(self.fd, offset, os.SEEK_SET)
-        data = os.read(self.fd, size)
+        data = os.pread(self.fd, size, offset)
         assert data, "offset %s size %d %s" % (hex(offset), size, data)
-        return int_from_data(data, size)
+        return self._unpackers[size](data)[0]
 
     def read8(self, offset):
         return self.read(offset, 1)
@@ -185,11 +204,54 @@ class FileRaw(object):
     def read32(self, offset):
         return self.read(offset, 4)
 
+    def read32_many(self, offsets):
+        """Read the dwords at the given offsets, sorted by offset, with a
+        single pread for each run of contiguous dwords. Dwords in between
+        runs are not read."""
+        values = []
+        run_start = None
+        run_len = 0
+        for offset in offsets:
+            if run_len and offset != run_start + 4 * run_len:
+                values.extend(self._read32_run(run_start, run_len))
+                run_len = 0
+            if not run_len:
+                run_start = offset
+            run_len += 1
+        if run_len:
+            values.extend(self._read32_run(run_start, run_len))
+        return values
+
+    def _read32_run(self, offset, count):
+        data = os.pread(self.fd, 4 * count, offset)
+        return struct.unpack("=%dI" % count, data)
+
+    def write32_many(self, writes):
+        """Write (offset, dword) pairs sorted by offset, with a single pwrite
+        for each run of contiguous dwords. The kernel still splits the
+        writes into dword config accesses, in order."""
+        run_start = None
+        run = []
+        for offset, data in writes:
+            if run and offset != run_start + 4 * len(run):
+                os.pwrite(self.fd, struct.pack("=%dI" % len(run), *run), run_start)
+                run = []
+            if not run:
+                run_start = offset
+            run.append(data)
+        if run:
+            os.pwrite(self.fd, struct.pack("=%dI" % len(run), *run), run_start)
+
+    # Compiled Struct objects by format for read_format()
+    _structs = {}
+
     def read_format(self, fmt, offset):
-        size = struct.calcsize(fmt)
-        os.lseek(self.fd, offset, os.SEEK_SET)
-        data = os.read(self.fd, size)
-        return struct.unpack(fmt, data)
+        fmt_struct = self._structs.get(fmt)
+        if fmt_struct is None:
+            fmt_struct = Struct(fmt)
+            self._structs[fmt] = fmt_struct
+        data = os.pread(self.fd, fmt_struct.size, offset)
+        return fmt_struct.unpack(data)
 
 class FileMap(object):
 
@@ -204,41 +266,59 @@ class FileMap(object):
             self.map_16 = self.mapped.cast("H")
             self.map_32 = self.mapped.cast("I")
 
+        # Accessors by size for read()
+        self._readers = {1: self.read8, 2: self.read16, 4: self.read32}
 
     def write8(self, offset, data):
-        self.map_8[offset // 1] = data
+        self.map_8[offset] = data
 
     def write16(self, offset, data):
-        self.map_16[offset // 2] = data
+        self.map_16[offset >> 1] = data
 
     def write32(self, offset, data):
-        self.map_32[offset // 4] = data
+        self.map_32[offset >> 2] = data
 
     def read8(self, offset):
-        return self.map_8[offset // 1]
+        return self.map_8[offset]
 
     def read16(self, offset):
-        return self.map_16[offset // 2]
+        return self.map_16[offset >> 1]
 
     def read32(self, offset):
-        return self.map_32[offset // 4]
+        return self.map_32[offset >> 2]
+
+    def read32_bulk(self, offset, count):
+        """Read count consecutive dwords starting at offset. Each dword is
+        still read with its own 32-bit access, just without a Python level
+        call per dword."""
+        index = offset >> 2
+        return self.map_32[index : index + count].tolist()
+
+    def read32_repeat(self, offset, count):
+        """Read the dword at offset count times, for FIFO like data ports"""
+        map_32 = self.map_32
+        index = offset >> 2
+        return [map_32[index] for _ in range(count)]
+
+    def write32_repeat(self, offset, values):
+        """Write all values to the dword at offset, for FIFO like data ports"""
+        map_32 = self.map_32
+        index = offset >> 2
+        for value in values:
+            map_32[index] = value
 
     def read(self, offset, size):
-        if size == 1:
-            return self.read8(offset)
-        elif size == 2:
-            return self.read16(offset)
-        elif size == 4:
-            return self.read32(offset)
-        else:
+        reader = self._readers.get(size)
+        if reader is None:
             raise ValueError(f"Unhandled read size {size}")
+        return reader(offset)
 
 # Check that modules needed to access devices on the system are available
 def check_device_module_deps():
     pass
 
 
-GPU_ARCHES = ["kepler", "maxwell", "pascal", "volta", "turing", "ampere", "ada", "hopper", "blackwell"]
+GPU_ARCHES = ("kepler", "maxwell", "pascal", "volta", "turing", "ampere", "ada", "hopper", "blackwell")
 NVSWITCH_MAP = {
     0x6000a1: {
         "name": "LR10",
@@ -267,7 +347,7 @@ NVSWITCH_MAP = {
         "needs_falcons_cfg": False,
     }
 }
-NVSWITCH_ARCHES = ["limerock", "laguna"]
+NVSWITCH_ARCHES = ("limerock", "laguna")
 
 # For architectures with multiple products, match by device id as well. The
 # values from this map are what's used in the GPU_MAP.
@@ -1123,7 +1203,94 @@ GPU_MAP = {
 
 }
 
-if is_linux:
+class FalconCfg(object):
+    """Static configuration of a falcon from the GPU/NvSwitch maps. Settings
+    missing from the config are None."""
+    __slots__ = ("imem_size", "dmem_size", "emem_size", "imem_port_count", "dmem_port_count", "default_core_falcon", "can_run_ns")
+
+    def __init__(self, **cfg):
+        for field in self.__slots__:
+            object.__setattr__(self, field, cfg.pop(field, None))
+        if cfg:
+            raise ValueError(f"Unknown falcon config settings {sorted(cfg)}")
+
+    # Instances are shared between falcons and GPUs with the same config, so
+    # they can't be modified after creation.
+    def __setattr__(self, name, value):
+        raise AttributeError(f"FalconCfg is immutable, can't set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"FalconCfg is immutable, can't delete {name}")
+
+    # Immutable and interned, copies can just share the instance and
+    # unpickling gets the interned instance back
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        if self is NO_FALCON_CFG:
+            return "NO_FALCON_CFG"
+        cfg = {field: getattr(self, field) for field in self.__slots__ if getattr(self, field) is not None}
+        return (_falcon_cfg, (cfg,))
+
+# Config of falcons missing from falcons_cfg, everything falls back to HW
+NO_FALCON_CFG = FalconCfg()
+
+# Many falcons share the exact same config across GPUs, keep a single
+# FalconCfg instance for each distinct config.
+_FALCON_CFGS = {}
+
+def _falcon_cfg(cfg):
+    key = tuple(sorted(cfg.items()))
+    falcon_cfg = _FALCON_CFGS.get(key)
+    if falcon_cfg is None:
+        falcon_cfg = FalconCfg(**cfg)
+        _FALCON_CFGS[key] = falcon_cfg
+    return falcon_cfg
+
+def _with_falcon_cfgs(props):
+    # Props with the raw falcons_cfg dicts replaced by shared FalconCfg objects.
+    # The maps themselves stay plain literals, only entries that are actually
+    # looked up get converted.
+    if "falcons_cfg" not in props:
+        return props
+    falcons_cfg = {name: _falcon_cfg(cfg) for name, cfg in props["falcons_cfg"].items()}
+    return dict(props, falcons_cfg=falcons_cfg)
+
+@functools.lru_cache(maxsize=None)
+def gpu_props_for(boot0, devid):
+    """Get the GPU_MAP props matching PMC_BOOT_0 and the PCI device id, or
+    None for unknown GPUs"""
+    multiple = GPU_MAP_MULTIPLE.get(boot0)
+    if multiple is not None:
+        # Check for a device id match. Fall back to the default, if not found.
+        props = GPU_MAP.get(multiple["devids"].get(devid, multiple["default"]))
+    else:
+        props = GPU_MAP.get(boot0)
+    if props is None:
+        return None
+    return _with_falcon_cfgs(props)
+
+@functools.lru_cache(maxsize=None)
+def nvswitch_props_for(boot0):
+    """Get the NVSWITCH_MAP props matching PMC_BOOT_0, or None for unknown
+    NvSwitches"""
+    props = NVSWITCH_MAP.get(boot0)
+    if props is None:
+        return None
+    return _with_falcon_cfgs(props)
+
+_libc = None
+
+def load_libc():
+    """Load libc with ctypes on first use, only needed by a few commands"""
+    global _libc
+    if _libc is not None:
+        return _libc
+
     import ctypes
     libc = ctypes.cdll.LoadLibrary('libc.so.6')
 
@@ -1134,14 +1301,28 @@ if is_linux:
     libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
     libc.munmap.restype = ctypes.c_int
 
+    _libc = libc
+    return _libc
+
 class RawBitfield(object):
+    __slots__ = ("value",)
+
     def __init__(self, value=0):
         self.value = value
 
+    # (mask, start) by slice (start, stop, step), shared by all bitfields.
+    # Slices themselves aren't hashable.
+    _masks = {}
+
     def __get_mask(self, key):
         if not isinstance(key, slice):
             raise TypeError("Wrong type for key {0}".format(type(key)))
 
+        slice_key = (key.start, key.stop, key.step)
+        mask_start = self._masks.get(slice_key)
+        if mask_start is not None:
+            return mask_start
+
         start, stop, stride = key.indices(32)
         if stride != 1:
             raise IndexError("Stride has to be 1, got {0}".format(stride))
@@ -1149,7 +1330,9 @@ class RawBitfield(object):
         # slices have stop exclusive
         mask = (1 << (stop - start)) - 1
         mask <<= start
-        return (mask, start)
+        mask_start = (mask, start)
+        self._masks[slice_key] = mask_start
+        return mask_start
 
     def __getitem__(self, key):
         mask, start = self.__get_mask(key)
@@ -1162,6 +1345,8 @@ class RawBitfield(object):
         self.value = (self.value & ~mask) | (bits << start)
 
 class GpuBitfield(RawBitfield):
+    __slots__ = ("gpu", "offset", "deferred", "_deferred_outside", "_value_outside")
+
     def __init__(self, gpu, offset, init_value=None, deferred=False):
         self.gpu = gpu
         self.offset = offset
@@ -1173,7 +1358,9 @@ class GpuBitfield(RawBitfield):
         super(GpuBitfield, self).__init__(value)
 
     def __getitem__(self, key):
-        self.value = self.gpu.read(self.offset)
+        # Re-reading while deferred would drop the pending field writes
+        if not self.deferred:
+            self.value = self.gpu.read(self.offset)
         return super(GpuBitfield, self).__getitem__(key)
 
     def __setitem__(self, key, bits):
@@ -1184,6 +1371,22 @@ class GpuBitfield(RawBitfield):
     def commit(self):
         self.gpu.write(self.offset, self.value)
 
+    def __enter__(self):
+        # Defer the field writes made within the block and commit them with a
+        # single register write on exit.
+        self._deferred_outside = self.deferred
+        self._value_outside = self.value
+        self.deferred = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.deferred = self._deferred_outside
+        if exc_type is None:
+            self.commit()
+        else:
+            # Drop the field writes of the failed block
+            self.value = self._value_outside
+
 class DeviceField(object):
     """Wrapper for a device register/setting defined by a bitfield class and
     accessible with dev.read()/write() at the specified offset"""
@@ -1195,25 +1398,61 @@ class DeviceField(object):
         if name is None:
             name = bitfield_class.__name__
         self.name = name
-        self._read()
+        self.value = bitfield_class(dev.read(offset, self.size), name=name)
+        self.deferred = False
+        # Raw values at the entry of each nested batch() block
+        self._batch_entry_values = []
 
     def _read(self):
-        raw = self.dev.read(self.offset, self.size)
-        self.value = self.bitfield_class(raw, name=self.name)
+        # Refresh the existing bitfield in place instead of allocating a new
+        # one for every access.
+        self.value.raw = self.dev.read(self.offset, self.size)
         return self.value
 
     def _write(self):
         self.dev.write(self.offset, self.value.raw, self.size)
 
     def __getitem__(self, field):
-        self._read()
+        if not self.deferred:
+            self._read()
         return self.value[field]
 
     def __setitem__(self, field, val):
+        if self.deferred:
+            self.value[field] = val
+            return
         self._read()
         self.value[field] = val
         self._write()
 
+    def snapshot(self):
+        """Read the register once and return a separate bitfield with its
+        value, for inspecting multiple fields without a read for each"""
+        return self.bitfield_class(self.dev.read(self.offset, self.size), name=self.name)
+
+    def batch(self):
+        """Context manager reading the register once on entry and committing
+        all the field writes made within the block with a single write on
+        exit. Nested blocks join the outermost one, which does the read and
+        the write. A block exiting with an exception drops its field
+        writes."""
+        return self
+
+    def __enter__(self):
+        if not self._batch_entry_values:
+            self._read()
+        self._batch_entry_values.append(self.value.raw)
+        self.deferred = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        entry_value = self._batch_entry_values.pop()
+        self.deferred = bool(self._batch_entry_values)
+        if exc_type is not None:
+            self.value.raw = entry_value
+        elif not self.deferred:
+            self._write()
+
     def write_only(self, field, val):
         """Write to the device with only the field set as specified. Useful for W1C bits"""
 
@@ -1233,6 +1472,28 @@ class DeviceField(object):
 
 DEVICES = { }
 
+# Cleanups to run at exit. They are drained by a single atexit handler,
+# registered when the module is imported, so they run after any atexit
+# handlers registered later and before the ones registered earlier.
+# Cleanups themselves run in LIFO order, like atexit handlers. A failing
+# cleanup has its traceback printed and doesn't stop the remaining ones.
+EXIT_CLEANUPS = []
+
+def _run_exit_cleanups():
+    while EXIT_CLEANUPS:
+        cleanup = EXIT_CLEANUPS.pop()
+        try:
+            cleanup()
+        except Exception as err:
+            _, _, tb = sys.exc_info()
+            traceback.print_tb(tb)
+            error(f"Exit cleanup {cleanup} failed: {err}")
+
+atexit.register(_run_exit_cleanups)
+
+def register_exit_cleanup(cleanup):
+    EXIT_CLEANUPS.append(cleanup)
+
 class Device(object):
     def __init__(self):
         self.parent = None
@@ -1271,6 +1532,11 @@ class Device(object):
     def has_exp(self):
         return False
 
+# Fields read from the standard config space header by PciDevice: vendor id,
+# device id, header type, subsystem vendor id, subsystem id and the
+# capability list pointer at PCI_CAPABILITY_LIST.
+PCI_HEADER_FORMAT = "<HH10xB29xHH4xB"
+
 class PciDevice(Device):
     @staticmethod
     def _open_config(dev_path):
@@ -1281,14 +1547,16 @@ class PciDevice(Device):
     def find_class_for_device(dev_path):
         pci_dev = PciDevice(dev_path)
         if pci_dev.has_exp():
+            pcie_type = pci_dev.pciflags["TYPE"]
+
             # Root port
-            if pci_dev.pciflags["TYPE"] == 0x4:
+            if pcie_type == 0x4:
                 if pci_dev.vendor == 0x8086:
                     return IntelRootPort
                 return PciBridge
 
             # Upstream port
-            if pci_dev.pciflags["TYPE"] == 0x5:
+            if pcie_type == 0x5:
                 # PlxBridge assumes full access to config space. If not full
                 # config space is available, fall back to a regular PciBridge.
                 if pci_dev.config.size >= 4096 and pci_dev.vendor == 0x10b5:
@@ -1296,13 +1564,13 @@ class PciDevice(Device):
                 return PciBridge
 
             # Downstream port
-            if pci_dev.pciflags["TYPE"] == 0x6:
+            if pcie_type == 0x6:
                 if pci_dev.config.size >= 4096 and pci_dev.vendor == 0x10b5:
                     return PlxBridge
                 return PciBridge
 
             # Endpoint
-            if pci_dev.pciflags["TYPE"] == 0x0:
+            if pcie_type == 0x0:
                 if pci_dev.vendor == 0x10de:
                     return Gpu
 
@@ -1327,8 +1595,9 @@ class PciDevice(Device):
                 DEVICES[-1] = Device()
             return DEVICES[-1]
         bdf = os.path.basename(dev_path)
-        if bdf in DEVICES:
-            return DEVICES[bdf]
+        dev = DEVICES.get(bdf)
+        if dev is not None:
+            return dev
         dev = PciDevice.init_dispatch(dev_path)
         DEVICES[bdf] = dev
         return dev
@@ -1341,15 +1610,18 @@ class PciDevice(Device):
         self.children = []
         self.dev_path = dev_path
         self.bdf = os.path.basename(dev_path)
+        self.sysfs_power_control_path = os.path.join(dev_path, "power", "control")
+        self._flr_supported = None
         self.config = self._map_cfg_space()
 
-        self.vendor = self.config.read16(0)
-        self.device = self.config.read16(2)
-        self.svid = self.config.read16(0x2c)
-        self.ssid = self.config.read16(0x2e)
-        self.header_type = self.config.read8(0xe)
+        # Vendor/device, header type, subsystem ids and the capability
+        # pointer all sit in the first 0x35 bytes of config space, get them
+        # with a single read
+        (self.vendor, self.device, self.header_type, self.svid, self.ssid,
+         cap_offset) = self.config.read_format(PCI_HEADER_FORMAT, 0)
         self.cfg_space_broken = False
-        self._init_caps()
+        self._init_caps(cap_offset)
+        self._init_cap_flags()
         self._init_bars()
         if not self.cfg_space_broken:
             self.command = DeviceField(PciCommand, self.config, PCI_COMMAND)
@@ -1362,12 +1634,13 @@ class PciDevice(Device):
                 self.link_ctl = DeviceField(PciLinkControl, self.config, self.caps[PCI_CAP_ID_EXP] + PCI_EXP_LNKCTL)
                 self.link_status = DeviceField(PciLinkStatus, self.config, self.caps[PCI_CAP_ID_EXP] + PCI_EXP_LNKSTA)
                 self.link_status2 = DeviceField(PciLinkStatus2, self.config, self.caps[PCI_CAP_ID_EXP] + PCI_EXP_LNKSTA2)
+                pciflags = self.pciflags.snapshot()
                 # Root port or downstream port
-                if self.pciflags["TYPE"] == 0x4 or self.pciflags["TYPE"] == 0x6:
+                if pciflags["TYPE"] == 0x4 or pciflags["TYPE"] == 0x6:
                     self.link_ctl_2 = DeviceField(PciLinkControl2, self.config, self.caps[PCI_CAP_ID_EXP] + PCI_EXP_LNKCTL2)
-                if self.pciflags["TYPE"] == 4:
+                if pciflags["TYPE"] == 4:
                     self.rtctl = DeviceField(PciRootControl, self.config, self.caps[PCI_CAP_ID_EXP] + PCI_EXP_RTCTL)
-                if self.pciflags["SLOT"] == 1:
+                if pciflags["SLOT"] == 1:
                     self.slot_ctl = DeviceField(PciSlotControl, self.config, self.caps[PCI_CAP_ID_EXP] + PCI_EXP_SLTCTL)
                     self.slot_status = DeviceField(PciSlotStatus, self.config, self.caps[PCI_CAP_ID_EXP] + PCI_EXP_SLTSTA)
             if self.has_aer():
@@ -1399,47 +1672,42 @@ class PciDevice(Device):
             self.parent = Device()
 
     def _save_cfg_space(self):
-        self.saved_cfg_space = {}
-        for offset in GPU_CFG_SPACE_OFFSETS:
-            if offset >= self.config.size:
-                continue
-            self.saved_cfg_space[offset] = self.config.read32(offset)
-            #debug("%s saving cfg space %s = %s", self, hex(offset), hex(self.saved_cfg_space[offset]))
+        offsets = [offset for offset in GPU_CFG_SPACE_OFFSETS if offset < self.config.size]
+        self.saved_cfg_space = dict(zip(offsets, self.config.read32_many(offsets)))
+        #debug("%s saving cfg space %s", self, {hex(o): hex(v) for o, v in self.saved_cfg_space.items()})
 
     def _restore_cfg_space(self):
         assert self.saved_cfg_space
-        for offset in sorted(self.saved_cfg_space):
-            old = self.config.read32(offset)
-            new = self.saved_cfg_space[offset]
-            #debug("%s restoring cfg space %s = %s to %s", self, hex(offset), hex(old), hex(new))
-            self.config.write32(offset, new)
+        #debug("%s restoring cfg space to %s", self, {hex(o): hex(v) for o, v in self.saved_cfg_space.items()})
+        # Saved in GPU_CFG_SPACE_OFFSETS order, already sorted by offset
+        self.config.write32_many(self.saved_cfg_space.items())
 
     def is_hidden(self):
         return False
 
     def has_aer(self):
-        return PCI_EXT_CAP_ID_ERR in self.ext_caps
+        return self._has_aer
 
     def has_sriov(self):
-        return PCI_EXT_CAP_ID_SRIOV in self.ext_caps
+        return self._has_sriov
 
     def has_dpc(self):
-        return PCI_EXT_CAP_ID_DPC in self.ext_caps
+        return self._has_dpc
 
     def has_acs(self):
-        return PCI_EXT_CAP_ID_ACS in self.ext_caps
+        return self._has_acs
 
     def has_exp(self):
-        return PCI_CAP_ID_EXP in self.caps
+        return self._has_exp
 
     def has_pm(self):
-        return PCI_CAP_ID_PM in self.caps
+        return self._has_pm
 
     def has_pcie_gen4(self):
-        return PCI_EXT_CAP_GEN4 in self.ext_caps
+        return self._has_pcie_gen4
 
     def has_pcie_gen5(self):
-        return PCI_EXT_CAP_GEN5 in self.ext_caps
+        return self._has_pcie_gen5
 
     def reinit(self):
         self.__init__(self.dev_path)
@@ -1468,14 +1736,12 @@ class PciDevice(Device):
 
     def _init_bars_sysfs(self):
         self.bars = []
-        resources = open(os.path.join(self.dev_path, "resource")).readlines()
+        with open(os.path.join(self.dev_path, "resource")) as f:
+            resources = f.read().splitlines()
 
         # Consider only first 6 resources
         for bar_line in resources[:6]:
-            bar_line = bar_line.split(" ")
-            addr = int(bar_line[0], base=16)
-            end = int(bar_line[1], base=16)
-            flags = int(bar_line[2], base=16)
+            addr, end, flags = (int(field, 16) for field in bar_line.split())
             # Skip non-MMIO regions
             if flags & 0x1 != 0:
                 continue
@@ -1500,7 +1766,14 @@ class PciDevice(Device):
         return (~self._bar_reg_mask(offset, high=False) & (2**32 - 1)) + 1
 
     def _bar_size_64(self, offset):
-        mask = self._bar_reg_mask(offset, high=False) | (self._bar_reg_mask(offset + 4, high=True) << 32)
+        # Probe both registers of the BAR together, each step is a single
+        # config space access covering both dwords
+        offsets = (offset, offset + 4)
+        org = self.config.read32_many(offsets)
+        self.config.write32_many([(offset, 0xffffffff), (offset + 4, 0xffffffff)])
+        low, high = self.config.read32_many(offsets)
+        self.config.write32_many(zip(offsets, org))
+        mask = (low & ~0xf) | (high << 32)
         return (~mask & (2**64 - 1)) + 1
 
     def _init_bars_config_space(self):
@@ -1510,16 +1783,22 @@ class PciDevice(Device):
         else:
             max_bars = 2
 
+        # Read all the BAR registers at once. Includes the register after the
+        # last BAR as the upper half of a (broken) 64-bit BAR in the last slot
+        # is read from there.
+        bar_regs = self.config.read32_many([0x10 + bar_num * 4 for bar_num in range(max_bars + 1)])
+
         bar_num = 0
         while bar_num < max_bars:
-            bar_reg = self.config.read32(0x10 + bar_num * 4)
+            bar_reg = bar_regs[bar_num]
             is_mmio = bar_reg & 0x1 == 0
             if not is_mmio:
+                bar_num += 1
                 continue
             is_64bit = (bar_reg >> 1) & 0x3 == 0x2
             bar_addr = bar_reg & ~0xf
             if is_64bit:
-                bar_addr |= self.config.read32(0x10 + (bar_num + 1) * 4) << 32
+                bar_addr |= bar_regs[bar_num + 1] << 32
                 bar_size = self._bar_size_64(0x10 + bar_num * 4)
                 bar_num += 2
             else:
@@ -1544,11 +1823,9 @@ class PciDevice(Device):
         else:
             return FileMap("/dev/mem", bar_addr, bar_size)
 
-    def _init_caps(self):
+    def _init_caps(self, cap_offset):
         self.caps = {}
         self.ext_caps = {}
-        cap_offset = self.config.read8(PCI_CAPABILITY_LIST)
-        data = 0
         if cap_offset == 0xff:
             self.cfg_space_broken = True
             error("Broken device %s", self.dev_path)
@@ -1562,23 +1839,34 @@ class PciDevice(Device):
         self._init_ext_caps()
 
 
+    def _init_cap_flags(self):
+        # Capabilities don't change after init, answer the has_*() checks
+        # from flags computed once
+        self._has_aer = PCI_EXT_CAP_ID_ERR in self.ext_caps
+        self._has_sriov = PCI_EXT_CAP_ID_SRIOV in self.ext_caps
+        self._has_dpc = PCI_EXT_CAP_ID_DPC in self.ext_caps
+        self._has_acs = PCI_EXT_CAP_ID_ACS in self.ext_caps
+        self._has_exp = PCI_CAP_ID_EXP in self.caps
+        self._has_pm = PCI_CAP_ID_PM in self.caps
+        self._has_pcie_gen4 = PCI_EXT_CAP_GEN4 in self.ext_caps
+        self._has_pcie_gen5 = PCI_EXT_CAP_GEN5 in self.ext_caps
+
     def _init_ext_caps(self):
         if self.config.size <= PCI_CFG_SPACE_SIZE:
             return
 
         offset = PCI_CFG_SPACE_SIZE
-        header = self.config.read32(PCI_CFG_SPACE_SIZE)
         offsets = set()
         while offset != 0:
             if offset in offsets:
                 warning(f"{self} extended cap loop at {offset:#x}")
                 return
             offsets.add(offset)
+            header = self.config.read32(offset)
             cap = header & 0xffff
             self.ext_caps[cap] = offset
 
             offset = (header >> 20) & 0xffc
-            header = self.config.read32(offset)
 
     def __str__(self):
         return "PCI %s %s:%s" % (self.bdf, hex(self.vendor), hex(self.device))
@@ -1586,11 +1874,20 @@ class PciDevice(Device):
     def __hash__(self):
         return hash((self.bdf, self.vendor, self.device))
 
+    def set_command(self, memory=None, master=None):
+        """Update memory decode and/or bus mastering with a single read and
+        write of the command register. Settings left as None are kept."""
+        with self.command.batch() as command:
+            if memory is not None:
+                command["MEMORY"] = 1 if memory else 0
+            if master is not None:
+                command["MASTER"] = 1 if master else 0
+
     def set_command_memory(self, enable):
-        self.command["MEMORY"] = 1 if enable else 0
+        self.set_command(memory=enable)
 
     def set_bus_master(self, enable):
-        self.command["MASTER"] = 1 if enable else 0
+        self.set_command(master=enable)
 
     def cfg_read8(self, offset):
         return self.config.read8(offset)
@@ -1615,19 +1912,26 @@ class PciDevice(Device):
             return False
         return True
 
+    # The sysfs helpers below open the attribute directly and handle it
+    # missing, rather than stat()ing it first.
+
     def sysfs_power_control_get(self):
-        path = os.path.join(self.dev_path, "power", "control")
-        if not os.path.exists(path):
+        path = self.sysfs_power_control_path
+        try:
+            with open(path, "r") as f:
+                return f.readline().strip()
+        except FileNotFoundError:
             debug(f"{self} path not present: '{path}'")
             return "not_present"
-        return open(path, "r").readlines()[0].strip()
 
     def sysfs_power_control_set(self, mode):
-        path = os.path.join(self.dev_path, "power", "control")
-        if not os.path.exists(path):
+        path = self.sysfs_power_control_path
+        try:
+            f = open(path, "w")
+        except FileNotFoundError:
             debug("%s path not present: '%s'", self, path)
             return
-        with open(path, "w") as f:
+        with f:
             f.write(mode)
 
     def sysfs_remove(self):
@@ -1636,6 +1940,7 @@ class PciDevice(Device):
             debug("%s remove not present: '%s'", self, remove_path)
         with open(remove_path, "w") as f:
             f.write("1")
+        SYSFS_PARENTS.clear()
 
     def sysfs_rescan(self):
         path = os.path.join(self.dev_path, "rescan")
@@ -1643,22 +1948,27 @@ class PciDevice(Device):
             debug("%s path not present: '%s'", self, path)
         with open(path, "w") as f:
             f.write("1")
+        SYSFS_PARENTS.clear()
 
     def sysfs_unbind(self):
         unbind_path = os.path.join(self.dev_path, "driver", "unbind")
-        if not os.path.exists(unbind_path):
+        try:
+            f = open(unbind_path, "w")
+        except FileNotFoundError:
             debug("%s unbind not present: '%s', already unbound?", self, unbind_path)
             return
-        with open(unbind_path, "w") as f:
+        with f:
             f.write(self.bdf)
         debug("%s unbind done", self)
 
     def sysfs_bind(self, driver):
         bind_path = os.path.join("/sys/bus/pci/drivers/", driver, "bind")
-        if not os.path.exists(bind_path):
+        try:
+            f = open(bind_path, "w")
+        except FileNotFoundError:
             debug("%s bind not present: '%s'", self, bind_path)
             return
-        with open(bind_path, "w") as f:
+        with f:
             f.write(self.bdf)
         debug("%s bind to %s done", self, driver)
 
@@ -1683,10 +1993,11 @@ class PciDevice(Device):
         return self.reset_with_sbr()
 
     def is_flr_supported(self):
-        if not self.has_exp():
-            return False
-
-        return self.devcap["FLR"] == 1
+        # FLR support is a read-only capability, only query it once. Reset
+        # flows check it multiple times.
+        if self._flr_supported is None:
+            self._flr_supported = self.has_exp() and self.devcap["FLR"] == 1
+        return self._flr_supported
 
     def reset_pre(self):
         pass
@@ -1752,11 +2063,12 @@ class PciBridge(PciDevice):
     def toggle_sbr(self, sleep_after=True):
         modified_slot_ctl = False
         if self.has_exp() and self.pciflags["SLOT"] == 1:
-            saved_dll = self.slot_ctl["DLLSCE"]
-            saved_hpie = self.slot_ctl["HPIE"]
-            # Disable link state change notification
-            self.slot_ctl["DLLSCE"] = 0
-            self.slot_ctl["HPIE"] = 0
+            with self.slot_ctl.batch() as slot_ctl:
+                saved_dll = slot_ctl["DLLSCE"]
+                saved_hpie = slot_ctl["HPIE"]
+                # Disable link state change notification
+                slot_ctl["DLLSCE"] = 0
+                slot_ctl["HPIE"] = 0
             modified_slot_ctl = True
 
         self._set_sbr(True)
@@ -1770,8 +2082,9 @@ class PciBridge(PciDevice):
             self.slot_status["PDC"] = 1
             self.slot_status["DLLSC"] = 1
 
-            self.slot_ctl["DLLSCE"] = saved_dll
-            self.slot_ctl["HPIE"] = saved_hpie
+            with self.slot_ctl.batch() as slot_ctl:
+                slot_ctl["DLLSCE"] = saved_dll
+                slot_ctl["HPIE"] = saved_hpie
 
 
 
@@ -1808,7 +2121,9 @@ NV_XVE_BAR2_HI = 0x20
 NV_XVE_BAR3 = 0x24
 NV_XVE_VCCAP_CTRL0 = 0x114
 
-GPU_CFG_SPACE_OFFSETS = [
+# Config space saved and restored around resets. Restore writes the
+# registers in this order, keep it sorted by offset.
+GPU_CFG_SPACE_OFFSETS = (
     NV_XVE_DEV_CTRL,
     NV_XVE_BAR0,
     NV_XVE_BAR1_LO,
@@ -1817,7 +2132,42 @@ GPU_CFG_SPACE_OFFSETS = [
     NV_XVE_BAR2_HI,
     NV_XVE_BAR3,
     NV_XVE_VCCAP_CTRL0,
-]
+)
+
+# Register polling starts with this sleep between reads and doubles it up to
+# the caller's sleep_interval, so registers that settle quickly don't cost a
+# full interval.
+POLL_INITIAL_SLEEP_INTERVAL = 0.0001
+
+# NVLink link states, low nibble of the NVLIPT_LNK state register
+NVLINK_LINK_STATES = {
+    0x1: "active",
+    0x2: "l2",
+    0x5: "active_pending",
+    0x8: "empty",
+    0x9: "reset",
+    0xd: "shutdown",
+    0xe: "contain",
+    0xf: "disable",
+}
+
+# NVLink DL states, low byte of the NVLDL state register
+NVLINK_DL_LINK_STATES = {
+    0x0: "init",
+    0xc: "hwpcfg",
+    0x1: "hwcfg",
+    0x2: "swcfg",
+    0x3: "active",
+    0x4: "fault",
+    0x5: "sleep",
+    0x8: "rcvy ac",
+    0xa: "rcvy rx",
+    0xb: "train",
+    0xd: "test",
+}
+
+# NVLink DL states in which a link is considered to be in high speed mode
+NVLINK_DL_HS_STATES = frozenset(["active", "sleep"])
 
 class BrokenGpu(PciDevice):
     def __init__(self, dev_path):
@@ -1863,7 +2213,6 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
                 prev_power_control = self.sysfs_power_control_get()
                 if prev_power_control != "on":
                     prev_power_state = self.pmctrl["STATE"]
-                    import atexit
 
                     self.sysfs_power_control_set("on")
                     power_state = self.pmctrl["STATE"]
@@ -1872,7 +2221,7 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
                         warning(f"{self} restoring power control to {prev_power_control}")
                         self.sysfs_power_control_set(prev_power_control)
 
-                    atexit.register(restore_power)
+                    register_exit_cleanup(restore_power)
 
             if self.pmctrl["STATE"] != 0:
                 warning("%s not in D0 (current state %d), forcing it to D0", self, self.pmctrl["STATE"])
@@ -1892,8 +2241,28 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
 
     def common_init(self):
         self.nvlink = None
+        # Bumped on every reset, the enabled links are re-queried when the
+        # epoch they were queried in is stale
+        self._nvlink_query_epoch = 0
+        self._nvlink_enabled_links_epoch = None
         if "nvlink" in self.props:
             self.nvlink = self.props["nvlink"]
+            if "links_per_group" in self.nvlink:
+                self._nvlink_init_offset_tables()
+
+    def _nvlink_init_offset_tables(self):
+        # Base offsets of the per group and per link units, looked up for
+        # every register accessed by the nvlink queries and debug dumps
+        links = self.nvlink["number"]
+        groups = -(-links // self.nvlink["links_per_group"])
+        group_bases = [self._nvlink_group_offset(group) for group in range(groups)]
+        link_bases = [self._nvlink_link_offset(link) for link in range(links)]
+        self._nvlink_nvlipt_bases = [base + 0x2000 for base in group_bases]
+        self._nvlink_minion_bases = [base + 0x4000 for base in group_bases]
+        self._nvlink_nvldl_bases = [base + 0x0 for base in link_bases]
+        self._nvlink_nvltlc_bases = [base + 0x5000 for base in link_bases]
+        self._nvlink_nvlipt_lnk_bases = [base + 0x7000 for base in link_bases]
+        self._nvlink_nport_top_bases = [base + 0x40000 for base in link_bases]
 
     @property
     def is_nvlink_supported(self):
@@ -1921,6 +2290,50 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
     def write(self, reg, data):
         self.bar0.write32(reg, data)
 
+    def read_bad_ok_many(self, regs):
+        """Read a sequence of registers without checking for bad reads. This
+        is a loop helper, each register is still its own MMIO read, in
+        order."""
+        read32 = self.bar0.read32
+        return [read32(reg) for reg in regs]
+
+    def read_bad_ok_repeat(self, reg, count):
+        """Read the same register count times without checking for bad reads,
+        one MMIO read each time"""
+        return self.bar0.read32_repeat(reg, count)
+
+    def write_repeat(self, reg, data):
+        """Write a sequence of values to the same register in order, one MMIO
+        write per value"""
+        self.bar0.write32_repeat(reg, data)
+
+    def write_many(self, writes):
+        """Write a sequence of (reg, data) pairs in order. This is a loop
+        helper, each register is still its own MMIO write."""
+        write32 = self.bar0.write32
+        for reg, data in writes:
+            write32(reg, data)
+
+    def write_verbose_many(self, writes, description):
+        """Write a sequence of (reg, data) pairs in order, logging a single
+        summary with the old and new values. Each register goes through the
+        same read, write, read back sequence as write_verbose(), and the
+        reads raise GpuError on bad reads even if debug logging is
+        disabled."""
+        read = self.read
+        write32 = self.bar0.write32
+        old = []
+        new = []
+        for reg, data in writes:
+            old.append(read(reg))
+            write32(reg, data)
+            new.append(read(reg))
+        if not logging.getLogger().isEnabledFor(logging.DEBUG):
+            return
+
+        summary = ", ".join(f"{reg:#x} = {data:#x} (old {o:#x} new {n:#x})" for (reg, data), o, n in zip(writes, old, new))
+        debug("%s %s: %s", self, description, summary)
+
     def write_verbose(self, reg, data):
         old = self.read(reg)
         self.bar0.write32(reg, data)
@@ -1943,6 +2356,9 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
         return True
 
     def reset_pre(self, reset_with_flr=None):
+        # Link state queried before the reset can't be trusted after it
+        self._nvlink_query_epoch += 1
+
         if self.is_gpu() and self.is_blackwell_plus:
             return
 
@@ -1964,6 +2380,8 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
             self.expected_sbr_only_scratch = 0
 
     def reset_post(self):
+        self._nvlink_query_epoch += 1
+
         if self.is_gpu() and self.is_blackwell_plus:
             return
 
@@ -2031,6 +2449,7 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
         else:
             read_function = self.read
 
+        sleep = min(POLL_INITIAL_SLEEP_INTERVAL, sleep_interval)
         timestamp = perf_counter()
         while True:
             loop_stamp = perf_counter()
@@ -2053,10 +2472,12 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
 
             if loop_stamp - timestamp > timeout:
                 raise GpuPollTimeout(f"Timed out polling register {name} ({offset:#x}), value {reg:#x} is not the expected {value:#x}. Timeout {timeout:.1f} secs")
-            if sleep_interval > 0.0:
-                time.sleep(sleep_interval)
+            if sleep > 0.0:
+                time.sleep(sleep)
+                sleep = min(sleep * 2, sleep_interval)
 
     def poll_register_any_bit(self, name, offset, mask, timeout, sleep_interval=0.01, debug_print=False):
+        sleep = min(POLL_INITIAL_SLEEP_INTERVAL, sleep_interval)
         timestamp = perf_counter()
         while True:
             loop_stamp = perf_counter()
@@ -2072,8 +2493,9 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
                 return
             if loop_stamp - timestamp > timeout:
                 raise GpuError("Timed out polling register %s (%s), value %s & %s is still 0. Timeout %f secs" % (name, hex(offset), hex(reg), hex(mask), timeout))
-            if sleep_interval > 0.0:
-                time.sleep(sleep_interval)
+            if sleep > 0.0:
+                time.sleep(sleep)
+                sleep = min(sleep * 2, sleep_interval)
 
     def get_pdi(self):
         assert self.has_pdi
@@ -2086,8 +2508,7 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
         assert self.is_nvlink_supported
 
         if self.name == "A100":
-            for nvlink in nvlinks:
-                self.block_nvlink_a100(nvlink)
+            self.block_nvlinks_a100(nvlinks)
             return
 
         if self.has_fsp:
@@ -2102,10 +2523,10 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
         return self.nvlink["base_offset"] + group * self.nvlink["per_group_offset"] + reg
 
     def _nvlink_nvlipt_offset(self, group, reg=0):
-        return self._nvlink_group_offset(group) + 0x2000 + reg
+        return self._nvlink_nvlipt_bases[group] + reg
 
     def _nvlink_minion_offset(self, group, reg=0):
-        return self._nvlink_group_offset(group) + 0x4000 + reg
+        return self._nvlink_minion_bases[group] + reg
 
     def _nvlink_link_offset(self, link, reg=0):
         group = link // self.nvlink["links_per_group"]
@@ -2113,16 +2534,16 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
         return self._nvlink_group_offset(group) + 0x10000 + local_link * 0x8000 + reg
 
     def _nvlink_nvldl_offset(self, link, reg=0):
-        return self._nvlink_link_offset(link) + 0x0 + reg
+        return self._nvlink_nvldl_bases[link] + reg
 
     def _nvlink_nvltlc_offset(self, link, reg=0):
-        return self._nvlink_link_offset(link) + 0x5000 + reg
+        return self._nvlink_nvltlc_bases[link] + reg
 
     def _nvlink_nvlipt_lnk_offset(self, link, reg=0):
-        return self._nvlink_link_offset(link) + 0x7000 + reg
+        return self._nvlink_nvlipt_lnk_bases[link] + reg
 
     def _nvlink_nport_top_offset(self, link, reg=0):
-        return self._nvlink_link_offset(link) + 0x40000 + reg
+        return self._nvlink_nport_top_bases[link] + reg
 
     def _nvlink_offset_func(self, unit):
         if unit == "io_ctrl":
@@ -2131,26 +2552,33 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
             return (lambda group, reg: self._nvlink_minion_offset(group, reg))
 
 
-    def _nvlink_query_enabled_links(self):
-        if hasattr(self, "nvlink_enabled_links"):
+    def _nvlink_query_enabled_links(self, force=False):
+        if not force and self._nvlink_enabled_links_epoch == self._nvlink_query_epoch:
             return self.nvlink_enabled_links
 
         if self.is_gpu() and self.is_blackwell_plus:
             return self._nvlink_query_enabled_links_b100()
-        self.nvlink_enabled_links = []
+        enabled_links = []
         groups = set()
         links = self.nvlink["number"]
+        links_per_group = self.nvlink["links_per_group"]
+        nvlipt_lnk_bases = self._nvlink_nvlipt_lnk_bases
+        read_bad_ok = self.read_bad_ok
+        link_state = self._nvlink_link_state_from_reg
         for link in range(links):
-            offset = self._nvlink_nvlipt_lnk_offset(link, 0x600)
-            data = self.read_bad_ok(offset)
+            # Links that are fused off or powered down read the status as
+            # 0xbadf, skip reading their state register
+            data = read_bad_ok(nvlipt_lnk_bases[link] + 0x600)
             if data >> 16 == 0xbadf:
                 continue
-            if self.nvlink_get_link_state(link) == "disable":
+            if link_state(read_bad_ok(nvlipt_lnk_bases[link] + 0x484)) == "disable":
                 continue
-            self.nvlink_enabled_links.append(link)
-            groups.add(link // self.nvlink["links_per_group"])
+            enabled_links.append(link)
+            groups.add(link // links_per_group)
+        self.nvlink_enabled_links = enabled_links
         self.nvlink_enabled_groups = sorted(groups)
-        return self.nvlink_enabled_links
+        self._nvlink_enabled_links_epoch = self._nvlink_query_epoch
+        return enabled_links
 
     def nvlink_debug_nport(self):
         self._nvlink_query_enabled_links()
@@ -2161,11 +2589,13 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
             ("NV_INTERNAL", 0x00004048),
         ]
 
-        for name, unit_offset in nport_regs:
-            for link in self.nvlink_enabled_links:
-                offset = self._nvlink_nport_top_offset(link, unit_offset)
-                data = self.read_bad_ok(offset)
-                debug(f"{self} link {link:2d} {name} 0x{offset:x} = 0x{data:x}")
+        bases = self._nvlink_nport_top_bases
+        links = self.nvlink_enabled_links
+        plan = [(link, name, bases[link] + unit_offset)
+                for name, unit_offset in nport_regs for link in links]
+        values = self.read_bad_ok_many([offset for _, _, offset in plan])
+        for (link, name, offset), data in zip(plan, values):
+            debug(f"{self} link {link:2d} {name} 0x{offset:x} = 0x{data:x}")
 
     def nvlink_debug_nvlipt_basic_state(self):
         group_regs = [
@@ -2177,11 +2607,12 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
             ("NV_INTERNAL", 0x00000114),
             ("NV_INTERNAL", 0x00000200),
         ]
-        for g in self.nvlink_enabled_groups:
-            for name, unit_offset in group_regs:
-                offset = self._nvlink_nvlipt_offset(g, unit_offset)
-                data = self.read_bad_ok(offset)
-                debug(f"{self} group {g:2d} {name} 0x{unit_offset:x} 0x{offset:x} = 0x{data:x}")
+        bases = self._nvlink_nvlipt_bases
+        plan = [(g, name, unit_offset, bases[g] + unit_offset)
+                for g in self.nvlink_enabled_groups for name, unit_offset in group_regs]
+        values = self.read_bad_ok_many([offset for _, _, _, offset in plan])
+        for (g, name, unit_offset, offset), data in zip(plan, values):
+            debug(f"{self} group {g:2d} {name} 0x{unit_offset:x} 0x{offset:x} = 0x{data:x}")
 
     def nvlink_debug_nvlipt_lnk_basic_state(self):
         regs = [
@@ -2209,12 +2640,13 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
             ("NV_INTERNAL", 0x00000650),
             ("NV_INTERNAL", 0x00000380),
         ]
-        for reg in regs:
-            for link in self.nvlink_enabled_links:
-                name, unit_offset = reg
-                offset = self._nvlink_nvlipt_lnk_offset(link, unit_offset)
-                data = self.read_bad_ok(offset)
-                debug(f"{self} link {link:2d} {name} 0x{unit_offset:x} 0x{offset:x} = 0x{data:x}")
+        bases = self._nvlink_nvlipt_lnk_bases
+        links = self.nvlink_enabled_links
+        plan = [(link, name, unit_offset, bases[link] + unit_offset)
+                for name, unit_offset in regs for link in links]
+        values = self.read_bad_ok_many([offset for _, _, _, offset in plan])
+        for (link, name, unit_offset, offset), data in zip(plan, values):
+            debug(f"{self} link {link:2d} {name} 0x{unit_offset:x} 0x{offset:x} = 0x{data:x}")
 
     def nvlink_debug_nvltlc_basic_state(self):
         regs = [
@@ -2227,12 +2659,13 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
             ("NV_INTERNAL", 0x00001124),
             ("NV_INTERNAL", 0x00001904),
         ]
-        for reg in regs:
-            for link in self.nvlink_enabled_links:
-                name, unit_offset = reg
-                offset = self._nvlink_nvltlc_offset(link, unit_offset)
-                data = self.read_bad_ok(offset)
-                debug(f"{self} link {link:2d} {name} 0x{unit_offset:x} 0x{offset:x} = 0x{data:x}")
+        bases = self._nvlink_nvltlc_bases
+        links = self.nvlink_enabled_links
+        plan = [(link, name, unit_offset, bases[link] + unit_offset)
+                for name, unit_offset in regs for link in links]
+        values = self.read_bad_ok_many([offset for _, _, _, offset in plan])
+        for (link, name, unit_offset, offset), data in zip(plan, values):
+            debug(f"{self} link {link:2d} {name} 0x{unit_offset:x} 0x{offset:x} = 0x{data:x}")
 
     def nvlink_debug_nvldl_basic_state(self):
         regs = [
@@ -2275,12 +2708,13 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
             ("NV_INTERNAL", 0x00003158),
             ("NV_INTERNAL", 0x0000315c),
         ]
-        for reg in regs:
-            for link in self.nvlink_enabled_links:
-                name, nvldl_offset = reg
-                offset = self._nvlink_nvldl_offset(link, nvldl_offset)
-                data = self.read_bad_ok(offset)
-                debug(f"{self} link {link:2d} {name} 0x{nvldl_offset:x} 0x{offset:x} = 0x{data:x}")
+        bases = self._nvlink_nvldl_bases
+        links = self.nvlink_enabled_links
+        plan = [(link, name, nvldl_offset, bases[link] + nvldl_offset)
+                for name, nvldl_offset in regs for link in links]
+        values = self.read_bad_ok_many([offset for _, _, _, offset in plan])
+        for (link, name, nvldl_offset, offset), data in zip(plan, values):
+            debug(f"{self} link {link:2d} {name} 0x{nvldl_offset:x} 0x{offset:x} = 0x{data:x}")
 
     def nvlink_debug_minion_basic_state(self):
         group_regs = [
@@ -2292,115 +2726,91 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
         link_regs = [
             ("NV_INTERNAL", 0x00002a00),
         ]
+        links_per_group = self.nvlink["links_per_group"]
+        plan = []
         for g in self.nvlink_enabled_groups:
-            for reg in group_regs:
-                name, minion_offset = reg
-                offset = self._nvlink_minion_offset(g, minion_offset)
-                data = self.read_bad_ok(offset)
-                debug(f"{self} minion {g:2d} {name} 0x{minion_offset:x} 0x{offset:x} = 0x{data:x}")
-
-            for local_link in range(self.nvlink["links_per_group"]):
-                for reg in link_regs:
-                    name, minion_offset = reg
-                    offset = self._nvlink_minion_offset(g, minion_offset) + 4 * local_link
-                    data = self.read_bad_ok(offset)
-                    debug(f"{self} minion {g:2d} link {local_link:2d} {name} 0x{minion_offset:x} 0x{offset:x} = 0x{data:x}")
+            base = self._nvlink_minion_bases[g]
+            plan.extend((f"minion {g:2d}", name, minion_offset, base + minion_offset)
+                        for name, minion_offset in group_regs)
+            plan.extend((f"minion {g:2d} link {local_link:2d}", name, minion_offset, base + minion_offset + 4 * local_link)
+                        for local_link in range(links_per_group) for name, minion_offset in link_regs)
+        values = self.read_bad_ok_many([offset for _, _, _, offset in plan])
+        for (unit, name, minion_offset, offset), data in zip(plan, values):
+            debug(f"{self} {unit} {name} 0x{minion_offset:x} 0x{offset:x} = 0x{data:x}")
 
     def nvlink_get_link_state(self, link):
 
         offset = self._nvlink_nvlipt_lnk_offset(link, 0x484)
         data = self.read_bad_ok(offset)
+        return self._nvlink_link_state_from_reg(data)
+
+    def _nvlink_link_state_from_reg(self, data):
         if data >> 16 == 0xbadf:
             return "badf"
 
         state = data & 0xf
-        states = {
-            0x1: "active",
-            0x2: "l2",
-            0x5: "active_pending",
-            0x8: "empty",
-            0x9: "reset",
-            0xd: "shutdown",
-            0xe: "contain",
-            0xf: "disable",
-        }
-        if state in states:
-            return states[state]
+        if state in NVLINK_LINK_STATES:
+            return NVLINK_LINK_STATES[state]
         else:
             return str(state)
 
 
     def nvlink_get_link_states(self):
         self._nvlink_query_enabled_links()
-        if self.is_blackwell_plus:
+        if self.is_gpu() and self.is_blackwell_plus:
             return self.nvlink_get_link_states_b100()
 
-        self._nvlink_query_enabled_links()
-        states = []
-        for link in self.nvlink_enabled_links:
-            states.append(self.nvlink_get_link_state(link))
-        return states
+        bases = self._nvlink_nvlipt_lnk_bases
+        values = self.read_bad_ok_many([bases[link] + 0x484 for link in self.nvlink_enabled_links])
+        return [self._nvlink_link_state_from_reg(data) for data in values]
 
     def nvlink_dl_get_link_state(self, link):
         offset = self._nvlink_nvldl_offset(link, 0)
         data = self.read_bad_ok(offset)
+        return self._nvlink_dl_link_state_from_reg(data)
+
+    def _nvlink_dl_link_state_from_reg(self, data):
         if data >> 16 == 0xbadf:
             return "0xbadf"
 
         state = data & 0xff
-        states = {
-            0x0: "init",
-            0xc: "hwpcfg",
-            0x1: "hwcfg",
-            0x2: "swcfg",
-            0x3: "active",
-            0x4: "fault",
-            0x5: "sleep",
-            0x8: "rcvy ac",
-            0xa: "rcvy rx",
-            0xb: "train",
-            0xd: "test",
-        }
-        if state in states:
-            return states[state]
+        if state in NVLINK_DL_LINK_STATES:
+            return NVLINK_DL_LINK_STATES[state]
         else:
             return str(state)
 
     def nvlink_dl_get_link_states(self):
         self._nvlink_query_enabled_links()
-        states = []
-        for link in self.nvlink_enabled_links:
-            states.append(self.nvlink_dl_get_link_state(link))
-        return states
+        bases = self._nvlink_nvldl_bases
+        values = self.read_bad_ok_many([bases[link] for link in self.nvlink_enabled_links])
+        return [self._nvlink_dl_link_state_from_reg(data) for data in values]
 
     def nvlink_is_link_in_hs(self, link):
         if self.is_gpu() and self.is_blackwell_plus:
             return self.nvlink_get_link_states()[link] == "up"
-        link_state = self.nvlink_dl_get_link_state(link)
-        return link_state == "active" or link_state == "sleep"
+        return self.nvlink_dl_get_link_state(link) in NVLINK_DL_HS_STATES
 
     def nvlink_get_links_in_hs(self):
-        links_in_hs = []
-        self._nvlink_query_enabled_links()
+        enabled_links = self._nvlink_query_enabled_links()
 
         if self.is_gpu() and self.is_blackwell_plus:
             states = self.nvlink_get_link_states()
-            for link in self._nvlink_query_enabled_links():
-                if states[link] == "up":
-                    links_in_hs.append(link)
-            return links_in_hs
+            return [link for link in enabled_links if states[link] == "up"]
 
-        for link in self.nvlink_enabled_links:
-            if self.nvlink_is_link_in_hs(link):
-                links_in_hs.append(link)
-        return links_in_hs
+        dl_states = self.nvlink_dl_get_link_states()
+        return [link for link, state in zip(enabled_links, dl_states) if state in NVLINK_DL_HS_STATES]
 
     def nvlink_debug_h100(self):
         from collections import Counter
         self.wait_for_boot()
         self._nvlink_query_enabled_links()
-        links = self.nvlink_get_links_in_hs()
-        link_states = Counter(self.nvlink_dl_get_link_states())
+        # Query the DL state of each link once and derive the rest from it
+        dl_states = dict(zip(self.nvlink_enabled_links, self.nvlink_dl_get_link_states()))
+        if self.is_gpu() and self.is_blackwell_plus:
+            links = self.nvlink_get_links_in_hs()
+        else:
+            links = [link for link, state in dl_states.items() if state in NVLINK_DL_HS_STATES]
+        link_states = Counter(dl_states.values())
         info(f"{self} trained {len(links)} links {links} dl link states {link_states}")
         if self.is_nvswitch() or (self.is_sxm and not self.has_c2c):
             topo = NVLINK_TOPOLOGY_HGX_8_H100
@@ -2411,7 +2821,7 @@ class NvidiaDevice(PciDevice, NvidiaDeviceInternal):
                 else:
                     peer_link = "?"
                     peer_name = "?"
-                info(f"{self} {self.module_name} link {link} -> {peer_name}:{peer_link} {self.nvlink_dl_get_link_state(link)} {self.nvlink_get_link_state(link)}")
+                info(f"{self} {self.module_name} link {link} -> {peer_name}:{peer_link} {dl_states[link]} {self.nvlink_get_link_state(link)}")
         self.nvlink_debug_nvlipt_basic_state()
         self.nvlink_debug_minion_basic_state()
         self.nvlink_debug_nvlipt_lnk_basic_state()
@@ -2686,6 +3096,11 @@ class GpuMemPort(object):
         self.falcon = falcon
         self.need_to_write_config_to_hw = True
 
+        # GPU accessors used for the dwords transferred through the port
+        self._gpu_read_bad_ok_repeat = falcon.gpu.read_bad_ok_repeat
+        self._gpu_write = falcon.gpu.write
+        self._gpu_write_repeat = falcon.gpu.write_repeat
+
     def __str__(self):
         return "%s offset %d (0x%x) incr %d incw %d max size %d (0x%x) control reg 0x%x = 0x%x" % (self.name,
                 self.offset, self.offset, self.auto_inc_read, self.auto_inc_write,
@@ -2730,10 +3145,8 @@ class GpuMemPort(object):
             self.configure(0, self.auto_inc_read, self.auto_inc_write, self.secure_imem)
 
     def read(self, size):
-        data = []
-        for offset in range(0, size, 4):
-            # MEM could match 0xbadf... so use read_bad_ok()
-            data.append(self.falcon.gpu.read_bad_ok(self.data_reg))
+        # MEM could match 0xbadf... so use read_bad_ok()
+        data = self._gpu_read_bad_ok_repeat(self.data_reg, (size + 3) // 4)
 
         if self.auto_inc_read:
             self.offset += size
@@ -2742,15 +3155,20 @@ class GpuMemPort(object):
 
         return data
 
-    def write(self, data, debug_write=False):
-        for d in data:
-            if debug_write:
+    def _write_data(self, data, debug_write, offset_inc):
+        # The data register is a FIFO, every dword goes to the same register.
+        # With debug_write each dword is written and logged on its own.
+        if debug_write:
+            for i, d in enumerate(data):
                 control = self.falcon.gpu.read(self.control_reg)
-                debug("Writing data %s = %s offset %s, control %s", hex(self.data_reg), hex(d), hex(self.offset), hex(control))
-            self.falcon.gpu.write(self.data_reg, d)
-            if self.auto_inc_write:
-                self.offset += 4
+                debug("Writing data %s = %s offset %s, control %s", hex(self.data_reg), hex(d), hex(self.offset + i * offset_inc), hex(control))
+                self._gpu_write(self.data_reg, d)
+        else:
+            self._gpu_write_repeat(self.data_reg, data)
+        self.offset += len(data) * offset_inc
 
+    def write(self, data, debug_write=False):
+        self._write_data(data, debug_write, 4 if self.auto_inc_write else 0)
         self.handle_offset_wraparound()
 
 class GpuImemPort(GpuMemPort):
@@ -2759,24 +3177,24 @@ class GpuImemPort(GpuMemPort):
         self.imemt_reg = self.control_reg + NV_PPWR_FALCON_IMEMT(0) - NV_PPWR_FALCON_IMEMC(0)
 
     def write_with_tags(self, data, virt_base, debug_write=False):
-        for data_32 in data:
+        # Each 256-byte block is preceded by its tag, write the dwords up to
+        # the next block with a single _write_data() call
+        index = 0
+        while index < len(data):
             if virt_base & 0xff == 0:
                 if debug_write:
                     debug("Writing tag %s = %s offset %s", hex(self.imemt_reg), hex(virt_base), hex(self.offset))
-                self.falcon.gpu.write(self.imemt_reg, virt_base >> 8)
-
-            if debug_write:
-                control = self.falcon.gpu.read(self.control_reg)
-                debug("Writing data %s = %s offset %s, control %s", hex(self.data_reg), hex(data_32), hex(self.offset), hex(control))
-            self.falcon.gpu.write(self.data_reg, data_32)
-
-            virt_base += 4
-            self.offset += 4
-
-        while virt_base & 0xff != 0:
-            self.falcon.gpu.write(self.data_reg, 0)
-            virt_base += 4
-            self.offset += 4
+                self._gpu_write(self.imemt_reg, virt_base >> 8)
+            run = (0x100 - (virt_base & 0xff)) >> 2
+            chunk = data[index : index + run]
+            self._write_data(chunk, debug_write, 4)
+            index += len(chunk)
+            virt_base += 4 * len(chunk)
+
+        # Pad the last block with zeros
+        if virt_base & 0xff != 0:
+            padding = (0x100 - (virt_base & 0xff)) >> 2
+            self._write_data([0] * padding, False, 4)
 
         self.handle_offset_wraparound()
 
@@ -2788,16 +3206,30 @@ class GpuFalcon(object):
         self.base_page = cpuctl & ~0xfff
         self.base_page_emem = getattr(self, 'base_page_emem', self.base_page)
         self.cpuctl = cpuctl
+
+        # Register offsets derived from cpuctl and the base page, these don't
+        # change and are used for every memory port access
+        self.imemc = cpuctl + NV_PPWR_FALCON_IMEMC(0) - NV_PPWR_FALCON_CPUCTL
+        self.dmemc = cpuctl + NV_PPWR_FALCON_DMEMC(0) - NV_PPWR_FALCON_CPUCTL
+        self.bootvec = cpuctl + NV_PPWR_FALCON_BOOTVEC - NV_PPWR_FALCON_CPUCTL
+        self.dmactl = cpuctl + NV_PPWR_FALCON_DMACTL - NV_PPWR_FALCON_CPUCTL
+        self.engine_reset = cpuctl + NV_PPWR_FALCON_ENGINE_RESET - NV_PPWR_FALCON_CPUCTL
+        self.hwcfg = cpuctl + NV_PPWR_FALCON_HWCFG - NV_PPWR_FALCON_CPUCTL
+        self.hwcfg1 = cpuctl + NV_PPWR_FALCON_HWCFG1 - NV_PPWR_FALCON_CPUCTL
+        self.hwcfg_emem = cpuctl + 0x9bc
+        self.dmemd = self.dmemc + NV_PPWR_FALCON_IMEMD(0) - NV_PPWR_FALCON_IMEMC(0)
+        self.imemd = self.imemc + NV_PPWR_FALCON_IMEMD(0) - NV_PPWR_FALCON_IMEMC(0)
+        self.imemt = self.imemc + NV_PPWR_FALCON_IMEMT(0) - NV_PPWR_FALCON_IMEMC(0)
+        self.mailbox0 = self.base_page + 0x40
+        self.mailbox1 = self.base_page + 0x44
+        self.sctl = self.base_page + 0x240
+
         self.pmc_enable_mask = pmc_enable_mask
         self.pmc_device_enable_mask = pmc_device_enable_mask
+        self.cfg = device.falcons_cfg.get(name, NO_FALCON_CFG)
         self.no_outside_reset = getattr(self, 'no_outside_reset', False)
         self.has_emem = getattr(self, 'has_emem', False)
         self.num_emem_ports = getattr(self, 'num_emem_ports', 1)
-        self._max_imem_size = None
-        self._max_dmem_size = None
-        self._max_emem_size = None
-        self._imem_port_count = None
-        self._dmem_port_count = None
         self._default_core_falcon = None
         self._can_run_ns = None
 
@@ -2837,170 +3269,103 @@ class GpuFalcon(object):
     def __str__(self):
         return self.name
 
-    @property
-    def imemc(self):
-        return self.cpuctl + NV_PPWR_FALCON_IMEMC(0) - NV_PPWR_FALCON_CPUCTL
-
-    @property
-    def dmemc(self):
-        return self.cpuctl + NV_PPWR_FALCON_DMEMC(0) - NV_PPWR_FALCON_CPUCTL
-
-    @property
-    def bootvec(self):
-        return self.cpuctl + NV_PPWR_FALCON_BOOTVEC - NV_PPWR_FALCON_CPUCTL
-
-    @property
-    def dmactl(self):
-        return self.cpuctl + NV_PPWR_FALCON_DMACTL - NV_PPWR_FALCON_CPUCTL
-
-    @property
-    def engine_reset(self):
-        return self.cpuctl + NV_PPWR_FALCON_ENGINE_RESET - NV_PPWR_FALCON_CPUCTL
-
-    @property
-    def hwcfg(self):
-        return self.cpuctl + NV_PPWR_FALCON_HWCFG - NV_PPWR_FALCON_CPUCTL
-
-    @property
-    def hwcfg1(self):
-        return self.cpuctl + NV_PPWR_FALCON_HWCFG1 - NV_PPWR_FALCON_CPUCTL
-
-    @property
-    def hwcfg_emem(self):
-        return self.cpuctl + 0x9bc
-
-    @property
-    def dmemd(self):
-        return self.dmemc + NV_PPWR_FALCON_IMEMD(0) - NV_PPWR_FALCON_IMEMC(0)
-
-    @property
-    def imemd(self):
-        return self.imemc + NV_PPWR_FALCON_IMEMD(0) - NV_PPWR_FALCON_IMEMC(0)
-
-    @property
-    def imemt(self):
-        return self.imemc + NV_PPWR_FALCON_IMEMT(0) - NV_PPWR_FALCON_IMEMC(0)
-
-    @property
-    def mailbox0(self):
-        return self.base_page + 0x40
-
-    @property
-    def mailbox1(self):
-        return self.base_page + 0x44
-
-    @property
-    def sctl(self):
-        return self.base_page + 0x240
-
     @property
     def fbif_ctl2(self):
         return self.fbif_ctl + 0x60
 
-    @property
+    @functools.cached_property
     def max_imem_size(self):
-        if self._max_imem_size:
-            return self._max_imem_size
+        hwcfg_value = self.max_imem_size_from_hwcfg()
 
-        if self.name not in self.gpu.falcons_cfg:
+        # Use the imem size provided in the GPU config
+        value = self.cfg.imem_size
+        if value is None:
             if self.gpu.needs_falcons_cfg:
                 error("Missing imem/dmem config for falcon %s, falling back to hwcfg", self.name)
-            self._max_imem_size = self.max_imem_size_from_hwcfg()
-        else:
-            # Use the imem size provided in the GPU config
-            self._max_imem_size = self.gpu.falcons_cfg[self.name]["imem_size"]
+            value = hwcfg_value
 
         # And make sure it matches HW
-        if self._max_imem_size != self.max_imem_size_from_hwcfg():
-            raise GpuError("HWCFG imem doesn't match %d != %d" % (self._max_imem_size, self.max_imem_size_from_hwcfg()))
+        if value != hwcfg_value:
+            raise GpuError("HWCFG imem doesn't match %d != %d" % (value, hwcfg_value))
 
-        return self._max_imem_size
+        return value
 
-    @property
+    @functools.cached_property
     def max_dmem_size(self):
-        if self._max_dmem_size:
-            return self._max_dmem_size
+        hwcfg_value = self.max_dmem_size_from_hwcfg()
 
-        if self.name not in self.gpu.falcons_cfg:
+        # Use the dmem size provided in the GPU config
+        value = self.cfg.dmem_size
+        if value is None:
             if self.gpu.needs_falcons_cfg:
                 error("Missing imem/dmem config for falcon %s, falling back to hwcfg", self.name)
-            self._max_dmem_size = self.max_dmem_size_from_hwcfg()
-        else:
-            # Use the dmem size provided in the GPU config
-            self._max_dmem_size = self.gpu.falcons_cfg[self.name]["dmem_size"]
+            value = hwcfg_value
 
         # And make sure it matches HW
-        if self._max_dmem_size != self.max_dmem_size_from_hwcfg():
-            raise GpuError("HWCFG dmem doesn't match %d != %d" % (self._max_dmem_size, self.max_dmem_size_from_hwcfg()))
+        if value != hwcfg_value:
+            raise GpuError("HWCFG dmem doesn't match %d != %d" % (value, hwcfg_value))
 
-        return self._max_dmem_size
+        return value
 
-    @property
+    @functools.cached_property
     def max_emem_size(self):
-        if self._max_emem_size:
-            return self._max_emem_size
+        hwcfg_value = self.max_emem_size_from_hwcfg()
 
-        if self.name not in self.gpu.falcons_cfg or "emem_size" not in self.gpu.falcons_cfg[self.name]:
+        # Use the emem size provided in the GPU config
+        value = self.cfg.emem_size
+        if value is None:
             if self.gpu.needs_falcons_cfg:
                 error("Missing emem config for falcon %s, falling back to hwcfg", self.name)
-            self._max_emem_size = self.max_emem_size_from_hwcfg()
-        else:
-            # Use the emem size provided in the GPU config
-            self._max_emem_size = self.gpu.falcons_cfg[self.name]["emem_size"]
+            value = hwcfg_value
 
         # And make sure it matches HW
-        if self._max_emem_size != self.max_emem_size_from_hwcfg():
-            raise GpuError("HWCFG emem doesn't match %d != %d" % (self._max_emem_size, self.max_emem_size_from_hwcfg()))
+        if value != hwcfg_value:
+            raise GpuError("HWCFG emem doesn't match %d != %d" % (value, hwcfg_value))
 
-        return self._max_emem_size
+        return value
 
-    @property
+    @functools.cached_property
     def dmem_port_count(self):
-        if self._dmem_port_count:
-            return self._dmem_port_count
+        hwcfg_value = self.dmem_port_count_from_hwcfg()
 
-        if self.name not in self.gpu.falcons_cfg or "dmem_port_count" not in self.gpu.falcons_cfg[self.name]:
+        # Use the dmem port count provided in the GPU config
+        value = self.cfg.dmem_port_count
+        if value is None:
             if self.gpu.needs_falcons_cfg:
                 error("%s missing dmem port count for falcon %s, falling back to hwcfg", self.gpu, self.name)
-            self._dmem_port_count = self.dmem_port_count_from_hwcfg()
-        else:
-            # Use the dmem port count provided in the GPU config
-            self._dmem_port_count = self.gpu.falcons_cfg[self.name]["dmem_port_count"]
+            value = hwcfg_value
 
         # And make sure it matches HW
-        if self._dmem_port_count != self.dmem_port_count_from_hwcfg():
-            raise GpuError("HWCFG dmem port count doesn't match %d != %d" % (self._dmem_port_count, self.dmem_port_count_from_hwcfg()))
+        if value != hwcfg_value:
+            raise GpuError("HWCFG dmem port count doesn't match %d != %d" % (value, hwcfg_value))
 
-        return self._dmem_port_count
+        return value
 
-    @property
+    @functools.cached_property
     def imem_port_count(self):
-        if self._imem_port_count:
-            return self._imem_port_count
+        hwcfg_value = self.imem_port_count_from_hwcfg()
 
-        if self.name not in self.gpu.falcons_cfg or "imem_port_count" not in self.gpu.falcons_cfg[self.name]:
+        # Use the imem port count provided in the GPU config
+        value = self.cfg.imem_port_count
+        if value is None:
             if self.gpu.needs_falcons_cfg:
                 error("%s missing imem port count for falcon %s, falling back to hwcfg", self.gpu, self.name)
-            self._imem_port_count = self.imem_port_count_from_hwcfg()
-        else:
-            # Use the imem port count provided in the GPU config
-            self._imem_port_count = self.gpu.falcons_cfg[self.name]["imem_port_count"]
+            value = hwcfg_value
 
         # And make sure it matches HW
-        if self._imem_port_count != self.imem_port_count_from_hwcfg():
-            raise GpuError("HWCFG imem port count doesn't match %d != %d" % (self._imem_port_count, self.imem_port_count_from_hwcfg()))
+        if value != hwcfg_value:
+            raise GpuError("HWCFG imem port count doesn't match %d != %d" % (value, hwcfg_value))
 
-        return self._imem_port_count
+        return value
 
     @property
     def default_core_falcon(self):
         if self._default_core_falcon is not None:
             return self._default_core_falcon
 
-        if self.name not in self.gpu.falcons_cfg or "default_core_falcon" not in self.gpu.falcons_cfg[self.name]:
+        self._default_core_falcon = self.cfg.default_core_falcon
+        if self._default_core_falcon is None:
             self._default_core_falcon = not self.gpu.has_fsp
-        else:
-            self._default_core_falcon = self.gpu.falcons_cfg[self.name]["default_core_falcon"]
 
         if not self._default_core_falcon and not self.supports_two_cores_from_hwcfg():
             raise GpuError("%s HWCFG two core suppport mismatch with defaulting to non falcon" % (self.name))
@@ -3012,10 +3377,9 @@ class GpuFalcon(object):
         if self._can_run_ns is not None:
             return self._can_run_ns
 
-        if self.name not in self.gpu.falcons_cfg or "can_run_ns" not in self.gpu.falcons_cfg[self.name]:
+        self._can_run_ns = self.cfg.can_run_ns
+        if self._can_run_ns is None:
             self._can_run_ns = True
-        else:
-            self._can_run_ns = self.gpu.falcons_cfg[self.name]["can_run_ns"]
 
         if self._can_run_ns and self.has_hs_boot():
             raise GpuError("%s incompatible properties, can run NS and HS boot" % (self.name))
@@ -3651,12 +4015,12 @@ class NvSwitch(NvidiaDevice):
             debug("%s sanity check of bar0 failed", self)
             raise BrokenGpuError()
 
-        if self.pmcBoot0 not in NVSWITCH_MAP:
+        props = nvswitch_props_for(self.pmcBoot0)
+        if props is None:
             for off in [0x0, 0x88000, 0x88004]:
                 debug("%s offset 0x%x = 0x%x", self.bdf, off, self.read(off))
             raise UnknownGpuError("GPU %s %s bar0 %s" % (self.bdf, hex(self.pmcBoot0), hex(self.bar0_addr)))
 
-        props = NVSWITCH_MAP[self.pmcBoot0]
         self.props = props
         self.name = props["name"]
         self.arch = props["arch"]
@@ -3718,11 +4082,11 @@ class NvSwitch(NvidiaDevice):
 
     def dump_bar0(self):
         bar0_data = bytearray()
-        for offset in range(0, self.bar0_size, 4):
-            if offset % (128 * 1024) == 0:
-                debug("Dumped %d bytes so far", offset)
-            data = self.bar0.read32(offset)
-            bar0_data.extend(data_from_int(data, 4))
+        chunk_size = 128 * 1024
+        for offset in range(0, self.bar0_size, chunk_size):
+            debug("Dumped %d bytes so far", offset)
+            words = self.bar0.read32_bulk(offset, min(chunk_size, self.bar0_size - offset) // 4)
+            bar0_data.extend(struct.pack("=%dI" % len(words), *words))
 
         return bar0_data
 
@@ -3861,6 +4225,23 @@ class NvSwitch(NvidiaDevice):
             return "off"
 
 
+# Base of each A100 nvlink's registers in the io_ctrl space. 3 io_ctrls at
+# 0xA00000 + 0x40000 * n, each with 4 links starting at +0x17000 and 0x8000
+# apart.
+A100_NVLINK_BASES = tuple(0xA00000 + 0x40000 * (link // 4) + 0x17000 + 0x8000 * (link % 4) for link in range(12))
+
+# Per-link registers for blocking an A100 nvlink and locking it in the blocked
+# state until the next reset.
+A100_NVLINK_BLOCK_REG = 0x64c
+A100_NVLINK_LOCK_REG = 0x650
+
+GPU_AMPERE_100_NAMES = frozenset(["A100", "A30"])
+
+# H100 device ids with the module id exposed on GPIOs 0x9, 0x11 and 0x12 and
+# the subset of them with the top module id bit inverted.
+H100_MODULE_ID_DEVIDS = frozenset([0x2330, 0x2336, 0x2324, 0x233f])
+H100_MODULE_ID_BIT_FLIP_DEVIDS = frozenset([0x2330, 0x2336, 0x233f])
+
 class Gpu(NvidiaDevice):
     def __init__(self, dev_path):
         self.name = "?"
@@ -3889,20 +4270,13 @@ class Gpu(NvidiaDevice):
             debug("%s sanity check of bar0 failed", self)
             raise BrokenGpuError()
 
-        gpu_map_key = self.pmcBoot0
-
-        if gpu_map_key in GPU_MAP_MULTIPLE:
-            match = GPU_MAP_MULTIPLE[self.pmcBoot0]
-            # Check for a device id match. Fall back to the default, if not found.
-            gpu_map_key = GPU_MAP_MULTIPLE[self.pmcBoot0]["devids"].get(self.device, match["default"])
-
-        if gpu_map_key not in GPU_MAP:
+        gpu_props = gpu_props_for(self.pmcBoot0, self.device)
+        if gpu_props is None:
             for off in [0x0, 0x88000, 0x88004, 0x92000]:
                 debug("%s offset 0x%x = 0x%x", self.bdf, off, self.read_bad_ok(off))
             raise UnknownGpuError("GPU %s %s bar0 %s" % (self.bdf, hex(self.pmcBoot0), hex(self.bar0_addr)))
 
-        self.gpu_props = GPU_MAP[gpu_map_key]
-        gpu_props = self.gpu_props
+        self.gpu_props = gpu_props
         self.props = gpu_props
         self.name = gpu_props["name"]
         self.arch = gpu_props["arch"]
@@ -3916,6 +4290,7 @@ class Gpu(NvidiaDevice):
         self.is_forcing_ecc_on_after_reset_supported = gpu_props["forcing_ecc_on_after_reset_supported"]
         self.is_setting_ecc_after_reset_supported = self.is_ampere_plus
         self.is_mig_mode_supported = self.is_ampere_100
+        self.vbios_scratch_base = 0x1400 if self.is_turing_plus else 0x1580
         if not self.sanity_check():
             debug("%s sanity check failed", self)
             raise BrokenGpuError()
@@ -4058,7 +4433,7 @@ class Gpu(NvidiaDevice):
 
     @property
     def is_ampere_100(self):
-        return self.name in ["A100", "A30"]
+        return self.name in GPU_AMPERE_100_NAMES
 
     @property
     def is_ampere_10x(self):
@@ -4123,10 +4498,7 @@ class Gpu(NvidiaDevice):
         return self._mod_name
 
     def vbios_scratch_register(self, index):
-        if self.is_turing_plus:
-            return 0x1400 + index * 4
-        else:
-            return 0x1580 + index * 4
+        return self.vbios_scratch_base + index * 4
 
 
     def _scrubber_status(self):
@@ -4561,17 +4933,15 @@ class Gpu(NvidiaDevice):
         return self.bar0.write32(offset, data)
 
     def _falcon_dma(self, falcon, address, size, write, sysmem):
-        cfg = self.bitfield(falcon.fbif_transcfg)
-
-        cfg[2:3] = 0x1
-
-        cfg[0:2] = 0x1 if sysmem else 0x0
+        with self.bitfield(falcon.fbif_transcfg) as cfg:
+            cfg[2:3] = 0x1
+            cfg[0:2] = 0x1 if sysmem else 0x0
 
         self.write(falcon.fbif_ctl2, 1)
 
-        ctl = self.bitfield(falcon.fbif_ctl)
-        ctl[4:5] = 1
-        ctl[7:8] = 1
+        with self.bitfield(falcon.fbif_ctl) as ctl:
+            ctl[4:5] = 1
+            ctl[7:8] = 1
 
         dmactl = self.bitfield(falcon.dmactl)
         dmactl[0:1] = 0
@@ -4590,15 +4960,14 @@ class Gpu(NvidiaDevice):
         self.write(falcon.base_page + 0x11c, offset)
         self.write(falcon.base_page + 0x114, 0)
 
-        dma_cmd = self.bitfield(falcon.base_page + 0x118, init_value=0, deferred=True)
-        if write:
-            dma_cmd[5:6] = 1
+        with self.bitfield(falcon.base_page + 0x118, init_value=0) as dma_cmd:
+            if write:
+                dma_cmd[5:6] = 1
 
-        sizes = {4:0, 8:1, 16:2, 32:3, 64:4, 128:5, 256:6}
-        if size not in sizes:
-            raise ValueError("Invalid size {0}".format(size))
-        dma_cmd[8:11] = sizes[size]
-        dma_cmd.commit()
+            sizes = {4:0, 8:1, 16:2, 32:3, 64:4, 128:5, 256:6}
+            if size not in sizes:
+                raise ValueError("Invalid size {0}".format(size))
+            dma_cmd[8:11] = sizes[size]
 
         self.poll_register("dma done", falcon.base_page + 0x118, value=0x1 << 1, mask=0x1 << 1, timeout=0.1)
 
@@ -4839,17 +5208,7 @@ class Gpu(NvidiaDevice):
 
 
     def _nvlink_offset(self, link, reg=0):
-        io_ctrl_base = 0xA00000
-        per_io_ctrl_offset = 0x40000
-        io_bases = 3
-        link_0_offset = 0x17000
-        per_link_offset = 0x8000
-        links_per_io = 4
-
-        iob = link // links_per_io
-        iolink = link % links_per_io
-        link_offset = io_ctrl_base + per_io_ctrl_offset * iob + link_0_offset + per_link_offset * iolink
-        return link_offset + reg
+        return A100_NVLINK_BASES[link] + reg
 
     def nvlink_write(self, link, reg, data):
         reg_offset = self._nvlink_offset(link, reg)
@@ -4873,12 +5232,27 @@ class Gpu(NvidiaDevice):
         assert link >= 0
         assert link < 12
 
-        self.nvlink_write_verbose(link, 0x64c, 0x1)
+        self.nvlink_write_verbose(link, A100_NVLINK_BLOCK_REG, 0x1)
 
 
         if lock:
-            self.nvlink_write_verbose(link, 0x650, 0x1)
+            self.nvlink_write_verbose(link, A100_NVLINK_LOCK_REG, 0x1)
 
+    def block_nvlinks_a100(self, links, lock=True):
+        for link in links:
+            assert link >= 0
+            assert link < 12
+
+        # Block and then lock each link in turn, like block_nvlink_a100(),
+        # with a single summary log for all of them.
+        writes = []
+        for link in links:
+            base = A100_NVLINK_BASES[link]
+            writes.append((base + A100_NVLINK_BLOCK_REG, 0x1))
+            if lock:
+                writes.append((base + A100_NVLINK_LOCK_REG, 0x1))
+
+        self.write_verbose_many(writes, "blocking nvlinks %s%s" % (list(links), " and locking" if lock else ""))
 
     def block_nvlink(self, nvlink):
         assert self.name == "A100"
@@ -4888,7 +5262,7 @@ class Gpu(NvidiaDevice):
 
     def read_module_id_h100(self):
 
-        if self.device in [0x2330, 0x2336, 0x2324, 0x233f]:
+        if self.device in H100_MODULE_ID_DEVIDS:
             gpios = [0x9, 0x11, 0x12]
         else:
             raise GpuError(f"{self} has unknown mapping for module id")
@@ -4898,7 +5272,7 @@ class Gpu(NvidiaDevice):
             bit = (self.read(0x21200 + 4 * gpio) >> 14) & 0x1
             mod_id |= bit << i
 
-        if self.device in [0x2330, 0x2336, 0x233f]:
+        if self.device in H100_MODULE_ID_BIT_FLIP_DEVIDS:
             mod_id ^= 0x4
 
         return mod_id
@@ -4964,6 +5338,8 @@ def gpu_dma_test(gpu, verify_reads=True, verify_writes=True):
     #verify_reads=False
     #verify_writes=False
 
+    import ctypes
+
     use_falcon_dma = False
     if gpu.is_ampere_plus:
         # Ampere+ cannot use the bar0 window for accessing sysmem any more. Use
@@ -4997,7 +5373,7 @@ def gpu_dma_test(gpu, verify_reads=True, verify_writes=True):
     # 1 is MCL_CURRENT
     # 2 is MCL_FUTURE
     flags = 2
-    libc.mlockall(ctypes.c_int(flags))
+    load_libc().mlockall(ctypes.c_int(flags))
 
     while True:
         try:
@@ -5111,8 +5487,10 @@ def print_topo():
 def sysfs_pci_rescan():
     with open("/sys/bus/pci/rescan", "w") as rf:
         rf.write("1")
+    SYSFS_PARENTS.clear()
 
 def create_args():
+    import optparse
     argp = optparse.OptionParser(usage="usage: %prog [options]")
     argp.add_option("--gpu", type="int", default=-1)
     argp.add_option("--gpu-bdf", help="Select a single GPU by providing a substring of the BDF, e.g. '01:00'.")
@@ -21,21 +21,17 @@
 # DEALINGS IN THE SOFTWARE.
 #
 
-import platform
-is_linux = platform.system() == "Linux"
+# Field shifts are only computed once per class by BitfieldMeta, so a native implementation of
+# ffs() is enough and avoids loading libc with ctypes at import.
+def ffs(n):
+    return (n & (-n)).bit_length()
 
-# Use libc's ffs() on Linux and fall back to a native implementation otherwise.
-if is_linux:
-    import ctypes
-    libc = ctypes.cdll.LoadLibrary('libc.so.6')
+class BitfieldMeta(type):
+    def __init__(cls, name, bases, attrs):
+        super().__init__(name, bases, attrs)
+        cls.field_masks = cls._construct_field_masks()
 
-    def ffs(n):
-        return libc.ffs(n)
-else:
-    def ffs(n):
-        return (n & (-n)).bit_length()
-
-class Bitfield(object):
+class Bitfield(metaclass=BitfieldMeta):
     """Wrapper around bitfields, see PciUncorrectableErrors for an example"""
     fields = {}
 
@@ -45,32 +41,31 @@ class Bitfield(object):
             name = self.__class__.__name__
         self.name = name
 
-    def __field_get_mask(self, field):
-        bits = self.__class__.fields[field]
-        if isinstance(bits, int):
-            return bits
-
-        assert isinstance(bits, tuple)
-        high_bit = bits[0]
-        low_bit = bits[1]
-
-        mask = (1 << (high_bit - low_bit + 1)) - 1
-        mask <<= low_bit
-        return mask
-
-    def __field_get_shift(self, field):
-        mask = self.__field_get_mask(field)
-        assert mask != 0
-        return ffs(mask) - 1
+    @classmethod
+    def _construct_field_masks(cls):
+        """Build the {field: (mask, shift)} table of the class from fields"""
+        masks = {}
+        for field, bits in cls.fields.items():
+            if isinstance(bits, int):
+                mask = bits
+            else:
+                assert isinstance(bits, tuple)
+                high_bit = bits[0]
+                low_bit = bits[1]
+
+                mask = (1 << (high_bit - low_bit + 1)) - 1
+                mask <<= low_bit
+
+            assert mask != 0, "field %s of %s has an empty mask" % (field, cls.__name__)
+            masks[field] = (mask, ffs(mask) - 1)
+        return masks
 
     def __getitem__(self, field):
-        mask = self.__field_get_mask(field)
-        shift = self.__field_get_shift(field)
+        mask, shift = self.field_masks[field]
         return (self.raw & mask) >> shift
 
     def __setitem__(self, field, val):
-        mask = self.__field_get_mask(field)
-        shift = self.__field_get_shift(field)
+        mask, shift = self.field_masks[field]
 
         val = val << shift
         assert (val & ~mask) == 0, "value 0x%x mask 0x%x" % (val, mask)
@@ -81,11 +76,8 @@ class Bitfield(object):
         return self.name + " " + str(self.values()) + " raw " + hex(self.raw)
 
     def values(self):
-        vals = {}
-        for f in self.__class__.fields:
-            vals[f] = self[f]
-
-        return vals
+        raw = self.raw
+        return {f: (raw & mask) >> shift for f, (mask, shift) in self.field_masks.items()}
 
     def non_zero(self):
         ret = {}
@@ -21,6 +21,7 @@
 # DEALINGS IN THE SOFTWARE.
 #
 
+import os
 import struct
 
 def _struct_fmt(size):
@@ -39,11 +40,7 @@ def ints_from_data(data, size):
     fmt = _struct_fmt(size)
     # Wrap data in bytes() for python 2.6 compatibility
     data = bytes(data)
-    ints = []
-    for offset in range(0, len(data), size):
-        ints.append(struct.unpack(fmt, data[offset : offset + size])[0])
-
-    return ints
+    return [i for i, in struct.iter_unpack(fmt, data)]
 
 def int_from_data(data, size):
     fmt = _struct_fmt(size)
@@ -68,11 +65,16 @@ def ints_from_bytearray(ba, int_size):
     return ints
 
 def read_ints_from_path(path, offset, int_size, int_num=-1):
-    with open(path, 'rb') as f:
-        f.seek(offset, 0)
-        if int_num == -1:
-            size = -1
-        else:
-            size = int_size * int_num
+    if int_num == -1:
+        with open(path, 'rb') as f:
+            f.seek(offset, 0)
+            return ints_from_data(f.read(), int_size)
+
+    # Known size, read it all with a single pread()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        data = os.pread(fd, int_size * int_num, offset)
+    finally:
+        os.close(fd)
 
-        return ints_from_data(f.read(size), int_size)
+    return ints_from_data(data, int_size)